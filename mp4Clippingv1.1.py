@@ -16,8 +16,68 @@ MP4 クリッピング GUI (PyQt5 + moviepy)
 """
 
 import sys, os, math
+import functools
+import subprocess
+import threading
 from PyQt5 import QtCore, QtGui, QtWidgets
-from moviepy.editor import VideoFileClip
+
+# moviepy は import が重い（numpy, imageio, PIL などを読み込む）ので load_video で初めて import する
+
+# ハードウェアH.264エンコーダの候補（優先順）
+HW_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_vaapi"]
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# libx264 のプリセット（速い順）
+X264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium"]
+
+# 選択が動画の端からこのピクセル数（表示上）以内なら端まで選んだとみなす
+EDGE_SNAP = 1
+
+
+def _encoder_args(encoder, preset="veryfast"):
+    """エンコーダ名から (入力前のオプション, フィルタ, 出力オプション) を返す
+
+    preset は libx264 を使うとき（ハードウェアエンコーダが無いとき）のみ有効。
+    """
+    if encoder == "h264_vaapi":
+        # VAAPI はフレームをGPUメモリへアップロードしてから渡す必要がある
+        return (["-vaapi_device", VAAPI_DEVICE], ["format=nv12", "hwupload"],
+                ["-c:v", "h264_vaapi", "-b:v", "5M"])
+    if encoder == "h264_nvenc":
+        return [], [], ["-c:v", "h264_nvenc", "-preset", "p4", "-b:v", "5M", "-pix_fmt", "yuv420p"]
+    if encoder:
+        return [], [], ["-c:v", encoder, "-b:v", "5M", "-pix_fmt", "yuv420p"]
+    return [], [], [
+        "-c:v", "libx264", "-preset", preset, "-crf", "20", "-pix_fmt", "yuv420p",
+        "-threads", str(os.cpu_count() or 0),
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_hwenc():
+    """使用可能なハードウェアエンコーダ名を返す（無ければ None = libx264）"""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    for encoder in HW_ENCODERS:
+        if encoder not in result.stdout:
+            continue
+        # ビルドに含まれていてもデバイスが無いと使えないので、1フレームだけ試しにエンコードする
+        pre_args, filters, codec_args = _encoder_args(encoder)
+        probe = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", *pre_args,
+            "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+            "-frames:v", "1", *(["-vf", ",".join(filters)] if filters else []),
+            *codec_args, "-f", "null", "-",
+        ]
+        if subprocess.run(probe, capture_output=True).returncode == 0:
+            return encoder
+    return None
 
 
 class VideoWidget(QtWidgets.QLabel):
@@ -87,6 +147,59 @@ class VideoWidget(QtWidgets.QLabel):
         return (r.x(), r.y(), r.width(), r.height())
 
 
+class CropWorker(QtCore.QObject):
+    """ffmpeg をワーカースレッド (QThread) で実行し、進捗をシグナルで通知する"""
+    progress = QtCore.pyqtSignal(int)  # 進捗 (%)
+    finished = QtCore.pyqtSignal(str)  # 保存先パス
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, cmd, out_path, total_frames):
+        super().__init__()
+        self.cmd = cmd  # コマンドのリスト、またはワーカースレッドで組み立てる関数
+        self.out_path = out_path
+        self.total_frames = total_frames
+        self._stop = threading.Event()
+
+    def cancel(self):
+        """ffmpeg の中断を要求（どのスレッドから呼んでもよい）"""
+        self._stop.set()
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        # エンコーダの検出は ffmpeg を何度も起動するので、UI スレッドではなくここで行う
+        cmd = self.cmd() if callable(self.cmd) else self.cmd
+        try:
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                encoding="utf-8", errors="replace"
+            )
+        except OSError as e:
+            self.error.emit(f"Failed to start ffmpeg: {e}")
+            return
+
+        last_percent = -1
+        # -progress の出力（key=value の行）から進捗を拾う
+        for line in proc.stdout:
+            if self._stop.is_set():
+                proc.terminate()
+                break
+            key, _, value = line.strip().partition("=")
+            if key == "frame" and value.isdigit() and self.total_frames > 0:
+                percent = int(int(value) * 100 / self.total_frames)
+                if percent != last_percent:
+                    last_percent = percent
+                    self.progress.emit(percent)
+        error = proc.stderr.read().strip()
+        proc.wait()
+
+        if self._stop.is_set():
+            return
+        if proc.returncode != 0:
+            self.error.emit(error or f"ffmpeg exited with code {proc.returncode}")
+        else:
+            self.finished.emit(self.out_path)
+
+
 class MainWindow(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
@@ -98,6 +211,10 @@ class MainWindow(QtWidgets.QWidget):
         self.orig_w = 0
         self.orig_h = 0
 
+        # 保存処理のワーカーとスレッド
+        self.crop_worker = None
+        self.crop_thread = None
+
         self.video_widget = VideoWidget()
         self.video_widget.fileDropped.connect(self.load_video)
 
@@ -105,14 +222,43 @@ class MainWindow(QtWidgets.QWidget):
         self.crop_btn.clicked.connect(self.crop_and_save)
         self.crop_btn.setEnabled(False)
 
+        self.preset_combo = QtWidgets.QComboBox()
+        self.preset_combo.addItems(X264_PRESETS)
+        self.preset_combo.setCurrentText("veryfast")
+        self.preset_combo.setToolTip("libx264 preset (not used with a hardware encoder)")
+
+        # 切り出す時間範囲（ミリ秒）
+        self.start_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.start_slider.valueChanged.connect(self.on_start_changed)
+        self.start_slider.setEnabled(False)
+        self.end_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.end_slider.valueChanged.connect(self.on_end_changed)
+        self.end_slider.setEnabled(False)
+        self.range_label = QtWidgets.QLabel("")
+
         self.info_label = QtWidgets.QLabel("Drop an MP4 file onto the area above")
 
         layout = QtWidgets.QVBoxLayout(self)
         layout.addWidget(self.video_widget, stretch=1)
-        layout.addWidget(self.crop_btn)
+
+        range_layout = QtWidgets.QGridLayout()
+        range_layout.addWidget(QtWidgets.QLabel("Start:"), 0, 0)
+        range_layout.addWidget(self.start_slider, 0, 1)
+        range_layout.addWidget(QtWidgets.QLabel("End:"), 1, 0)
+        range_layout.addWidget(self.end_slider, 1, 1)
+        range_layout.addWidget(self.range_label, 0, 2, 2, 1)
+        layout.addLayout(range_layout)
+
+        button_layout = QtWidgets.QHBoxLayout()
+        button_layout.addWidget(QtWidgets.QLabel("Preset:"))
+        button_layout.addWidget(self.preset_combo)
+        button_layout.addWidget(self.crop_btn, stretch=1)
+        layout.addLayout(button_layout)
         layout.addWidget(self.info_label)
 
     def load_video(self, path):
+        from moviepy.editor import VideoFileClip
+
         try:
             self.clip = VideoFileClip(path)
         except Exception as e:
@@ -127,11 +273,46 @@ class MainWindow(QtWidgets.QWidget):
 
         self.show_frame(self.current_frame)
 
+        duration_ms = int(self.clip.duration * 1000)
+        for slider in (self.start_slider, self.end_slider):
+            slider.blockSignals(True)
+            slider.setRange(0, duration_ms)
+            slider.setEnabled(True)
+        self.start_slider.setValue(0)
+        self.end_slider.setValue(duration_ms)
+        for slider in (self.start_slider, self.end_slider):
+            slider.blockSignals(False)
+        self.update_range_label()
+
         self.info_label.setText(
             f"Loaded: {os.path.basename(path)} ({self.orig_w}x{self.orig_h}) FPS:{self.clip.fps} Duration:{self.clip.duration:.2f}s"
         )
         self.crop_btn.setEnabled(True)
 
+    def on_start_changed(self, value):
+        if value > self.end_slider.value():
+            self.end_slider.setValue(value)
+        self.update_range_label()
+
+    def on_end_changed(self, value):
+        if value < self.start_slider.value():
+            self.start_slider.setValue(value)
+        self.update_range_label()
+
+    def update_range_label(self):
+        start = self.start_slider.value() / 1000
+        end = self.end_slider.value() / 1000
+        self.range_label.setText(f"{start:.2f}s - {end:.2f}s ({end - start:.2f}s)")
+
+    def time_range_args(self):
+        """開始・終了スライダーから ffmpeg の -ss/-to を作る（全範囲なら省略）"""
+        args = []
+        if self.start_slider.value() > 0:
+            args += ["-ss", f"{self.start_slider.value() / 1000:.3f}"]
+        if self.end_slider.value() < self.end_slider.maximum():
+            args += ["-to", f"{self.end_slider.value() / 1000:.3f}"]
+        return args
+
     def show_frame(self, frame_rgb):
         h, w, ch = frame_rgb.shape
         bytes_per_line = ch * w
@@ -148,40 +329,65 @@ class MainWindow(QtWidgets.QWidget):
         self.video_widget.pixmap_img = pix
 
     def crop_and_save(self):
-        sel = self.video_widget.get_selection_normalized()
-        if not sel:
-            QtWidgets.QMessageBox.warning(
-                self, "No selection", "Please draw a rectangle on the video."
-            )
-            return
-
-        disp_x, disp_y, disp_w, disp_h = sel
         pixmap = self.video_widget.pixmap_img
         if pixmap is None:
             return
-        disp_w_pix = pixmap.width()
-        disp_h_pix = pixmap.height()
-
-        label_w = self.video_widget.width()
-        label_h = self.video_widget.height()
-        offset_x = max(0, (label_w - disp_w_pix) // 2)
-        offset_y = max(0, (label_h - disp_h_pix) // 2)
-
-        sel_x_in_pix = disp_x - offset_x
-        sel_y_in_pix = disp_y - offset_y
-        sel_w_in_pix = min(disp_w, disp_w_pix - sel_x_in_pix)
-        sel_h_in_pix = min(disp_h, disp_h_pix - sel_y_in_pix)
 
-        if sel_w_in_pix <= 0 or sel_h_in_pix <= 0:
-            QtWidgets.QMessageBox.warning(self, "Invalid", "Selection outside video.")
+        if self.start_slider.value() >= self.end_slider.value():
+            QtWidgets.QMessageBox.warning(self, "Invalid", "End must be after start.")
             return
 
-        scale_x = self.orig_w / disp_w_pix
-        scale_y = self.orig_h / disp_h_pix
-        x0 = int(round(sel_x_in_pix * scale_x))
-        y0 = int(round(sel_y_in_pix * scale_y))
-        x2 = int(round((sel_x_in_pix + sel_w_in_pix) * scale_x))
-        y2 = int(round((sel_y_in_pix + sel_h_in_pix) * scale_y))
+        sel = self.video_widget.get_selection_normalized()
+        if sel is None:
+            # 矩形を描いていなければ、時間の切り出しだけ行う
+            x0, y0, x2, y2 = 0, 0, self.orig_w, self.orig_h
+        else:
+            disp_x, disp_y, disp_w, disp_h = sel
+            disp_w_pix = pixmap.width()
+            disp_h_pix = pixmap.height()
+
+            label_w = self.video_widget.width()
+            label_h = self.video_widget.height()
+            offset_x = max(0, (label_w - disp_w_pix) // 2)
+            offset_y = max(0, (label_h - disp_h_pix) // 2)
+
+            # 動画の表示範囲内に収める
+            sel_left = max(0, disp_x - offset_x)
+            sel_top = max(0, disp_y - offset_y)
+            sel_right = min(disp_w_pix, disp_x - offset_x + disp_w)
+            sel_bottom = min(disp_h_pix, disp_y - offset_y + disp_h)
+
+            if sel_right <= sel_left or sel_bottom <= sel_top:
+                QtWidgets.QMessageBox.warning(self, "Invalid", "Selection outside video.")
+                return
+
+            # 動画の端から EDGE_SNAP ピクセル以内で止めた場合は、端まで選んだものとみなす
+            if sel_left <= EDGE_SNAP:
+                sel_left = 0
+            if sel_top <= EDGE_SNAP:
+                sel_top = 0
+            if sel_right >= disp_w_pix - EDGE_SNAP:
+                sel_right = disp_w_pix
+            if sel_bottom >= disp_h_pix - EDGE_SNAP:
+                sel_bottom = disp_h_pix
+
+            scale_x = self.orig_w / disp_w_pix
+            scale_y = self.orig_h / disp_h_pix
+            x0 = int(round(sel_left * scale_x))
+            y0 = int(round(sel_top * scale_y))
+            x2 = min(self.orig_w, int(round(sel_right * scale_x)))
+            y2 = min(self.orig_h, int(round(sel_bottom * scale_y)))
+
+        # 全体を選択している場合は時間の切り出しだけなので再エンコード不要
+        trim_only = x0 == 0 and y0 == 0 and x2 == self.orig_w and y2 == self.orig_h
+
+        # H.264 (yuv420p) は幅・高さが偶数である必要がある
+        x2 -= (x2 - x0) % 2
+        y2 -= (y2 - y0) % 2
+
+        if x2 <= x0 or y2 <= y0:
+            QtWidgets.QMessageBox.warning(self, "Invalid", "Invalid crop dimensions.")
+            return
 
         out_path, _ = QtWidgets.QFileDialog.getSaveFileName(
             self,
@@ -192,18 +398,83 @@ class MainWindow(QtWidgets.QWidget):
         if not out_path:
             return
 
+        if trim_only:
+            cmd = self.trim_command(out_path)
+        else:
+            cmd = self.crop_command(out_path, x0, y0, x2 - x0, y2 - y0)
+        duration = (self.end_slider.value() - self.start_slider.value()) / 1000
+        self.start_worker(cmd, out_path, int(duration * self.clip.fps))
+
+    def crop_command(self, out_path, x, y, w, h):
+        """ffmpeg の crop フィルタでクロップするコマンド（フレームを Python に通さない）
+
+        エンコーダの検出が遅いので、コマンドを組み立てる関数を返してワーカースレッドで呼ぶ。
+        """
+        preset = self.preset_combo.currentText()
+        time_range = self.time_range_args()
+        video_path = self.video_path
+
+        def build():
+            pre_args, filters, codec_args = _encoder_args(_detect_hwenc(), preset)
+            return [
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                "-nostats", "-progress", "pipe:1", *pre_args,
+                *time_range, "-i", video_path,
+                "-vf", ",".join([f"crop={w}:{h}:{x}:{y}", *filters]),
+                *codec_args, "-c:a", "copy", "-movflags", "+faststart", out_path,
+            ]
+        return build
+
+    def trim_command(self, out_path):
+        """再エンコードせずに時間範囲だけ切り出すコマンド（切れ目はキーフレーム単位になる）"""
+        return [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-nostats", "-progress", "pipe:1",
+            *self.time_range_args(), "-i", self.video_path,
+            "-c", "copy", "-avoid_negative_ts", "make_zero", out_path,
+        ]
+
+    def start_worker(self, cmd, out_path, total_frames):
+        """ffmpeg をワーカースレッドで実行する"""
         self.info_label.setText("Cropping... please wait")
-        QtWidgets.QApplication.processEvents()
+        self.crop_btn.setEnabled(False)
 
-        try:
-            cropped = self.clip.crop(x1=x0, y1=y0, x2=x2, y2=y2)
-            cropped.write_videofile(out_path, codec="libx264")
-            self.info_label.setText(f"Saved: {out_path}")
-            QtWidgets.QMessageBox.information(
-                self, "Done", f"Cropped video saved:\n{out_path}"
-            )
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to crop:\n{e}")
+        self.crop_worker = CropWorker(cmd, out_path, total_frames)
+        self.crop_thread = QtCore.QThread(self)
+        self.crop_worker.moveToThread(self.crop_thread)
+
+        self.crop_thread.started.connect(self.crop_worker.run)
+        self.crop_worker.progress.connect(self.on_crop_progress)
+        self.crop_worker.finished.connect(self.on_crop_finished)
+        self.crop_worker.error.connect(self.on_crop_failed)
+        self.crop_worker.finished.connect(self.crop_thread.quit)
+        self.crop_worker.error.connect(self.crop_thread.quit)
+        self.crop_thread.finished.connect(self.crop_worker.deleteLater)
+
+        self.crop_thread.start()
+
+    def on_crop_progress(self, percent):
+        self.info_label.setText(f"Cropping... {percent}%")
+
+    def on_crop_finished(self, out_path):
+        self.crop_btn.setEnabled(True)
+        self.info_label.setText(f"Saved: {out_path}")
+        QtWidgets.QMessageBox.information(
+            self, "Done", f"Cropped video saved:\n{out_path}"
+        )
+
+    def on_crop_failed(self, message):
+        self.crop_btn.setEnabled(True)
+        self.info_label.setText("Failed to crop")
+        QtWidgets.QMessageBox.critical(self, "Error", f"Failed to crop:\n{message}")
+
+    def closeEvent(self, event):
+        # 実行中の ffmpeg を止めてから閉じる
+        if self.crop_thread is not None and self.crop_thread.isRunning():
+            self.crop_worker.cancel()
+            self.crop_thread.quit()
+            self.crop_thread.wait()
+        event.accept()
 
 
 if __name__ == "__main__":
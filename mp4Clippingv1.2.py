@@ -5,6 +5,8 @@ MP4 クリッピング GUI (PyQt5 + OpenCV) - 修正版
 使い方:
  1) 必要ライブラリをインストール:
       pip install pyqt5 opencv-python
+   ※ 保存は ffmpeg で行います（crop フィルタ + 使えればハードウェアエンコーダ）。
+     ffmpeg が無い場合は OpenCV (mp4v) で保存します。
 
  2) 実行:
       python mp4_trimmer_gui_opencv.py
@@ -17,13 +19,132 @@ MP4 クリッピング GUI (PyQt5 + OpenCV) - 修正版
 """
 
 import sys, os
+import functools
+import importlib
+import json
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5 import QtCore, QtGui, QtWidgets
-import cv2
-import numpy as np
+
+# cv2 / numpy は起動を速くするため、使う関数の中で import する
+
+# パイプライン各段の間のキュー長（デコードが先行しすぎないようにするバックプレッシャー）
+PIPELINE_QUEUE_SIZE = 4
+
+# これより長い動画は時間で分割して並列エンコードする（秒）
+PARALLEL_MIN_DURATION = 600
+
+# QImage が BGR をそのまま扱えるか（Qt 5.14 以降）
+HAS_BGR888 = hasattr(QtGui.QImage, "Format_BGR888")
+
+# ハードウェアH.264エンコーダの候補（優先順）
+HW_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_vaapi"]
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+
+def _encoder_args(encoder):
+    """エンコーダ名から (入力前のオプション, フィルタ, 出力オプション) を返す"""
+    if encoder == "h264_vaapi":
+        # VAAPI はフレームをGPUメモリへアップロードしてから渡す必要がある
+        return (["-vaapi_device", VAAPI_DEVICE], ["format=nv12", "hwupload"],
+                ["-c:v", "h264_vaapi", "-b:v", "5M"])
+    if encoder == "h264_nvenc":
+        return [], [], ["-c:v", "h264_nvenc", "-preset", "p4", "-b:v", "5M", "-pix_fmt", "yuv420p"]
+    if encoder:
+        return [], [], ["-c:v", encoder, "-b:v", "5M", "-pix_fmt", "yuv420p"]
+    return [], [], ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p"]
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_hwenc():
+    """使用可能なハードウェアエンコーダ名を返す（無ければ None = libx264）"""
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    for encoder in HW_ENCODERS:
+        if encoder not in result.stdout:
+            continue
+        # ビルドに含まれていてもデバイスが無いと使えないので、1フレームだけ試しにエンコードする
+        pre_args, filters, codec_args = _encoder_args(encoder)
+        probe = [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", *pre_args,
+            "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+            "-frames:v", "1", *(["-vf", ",".join(filters)] if filters else []),
+            *codec_args, "-f", "null", "-",
+        ]
+        if subprocess.run(probe, capture_output=True).returncode == 0:
+            return encoder
+    return None
+
+
+def _run_ffmpeg(cmd, stop, on_frame=None):
+    """ffmpeg を実行する（-progress pipe:1 の frame= を on_frame に渡す）
+
+    stop がセットされたら ffmpeg を止める。失敗したら RuntimeError。
+    """
+    proc = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        encoding="utf-8", errors="replace"
+    )
+    # -progress の出力（key=value の行）から進捗を拾う
+    for line in proc.stdout:
+        if stop.is_set():
+            proc.terminate()
+            break
+        key, _, value = line.strip().partition("=")
+        if key == "frame" and value.isdigit() and on_frame:
+            on_frame(int(value))
+    error = proc.stderr.read().strip()
+    proc.wait()
+
+    if proc.returncode != 0 and not stop.is_set():
+        raise RuntimeError(error or f"ffmpeg exited with code {proc.returncode}")
+
+
+def _minimize_buffer(cap):
+    """VideoCapture の内部バッファを1フレームにする（未対応のバックエンドでは何もしない）"""
+    import cv2
+    try:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    except cv2.error:
+        pass
+
+
+def _has_pynvcodec():
+    """PyNvVideoCodec（と DLPack 受け渡し用の torch）が使えるか"""
+    try:
+        import PyNvVideoCodec  # noqa: F401
+        import torch  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _has_cuda_backend():
+    """GPU 上でデコード・クロップ・エンコードできるか"""
+    import cv2
+    try:
+        if cv2.cuda.getCudaEnabledDeviceCount() == 0 or not hasattr(cv2, "cudacodec"):
+            return False
+    except (AttributeError, cv2.error):
+        return False
+    return _has_pynvcodec()
 
 
 class VideoWidget(QtWidgets.QLabel):
     fileDropped = QtCore.pyqtSignal(str)
+    selectionChanged = QtCore.pyqtSignal()  # 選択範囲または表示範囲が変わった
+    resizeFinished = QtCore.pyqtSignal()  # ウィンドウのリサイズが止まった
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -41,6 +162,22 @@ class VideoWidget(QtWidgets.QLabel):
         self.original_pixmap = None  # オリジナルサイズのpixmap
         self.displayed_pixmap = None  # 表示用にスケールされたpixmap
         self.video_display_rect = None  # 動画が表示されている矩形範囲
+        self.source_size = None  # 元動画の解像度 (w, h)
+        self.scale = None  # 表示座標→元動画座標の倍率 (x, y)
+
+        # ドラッグ中の再描画は約60Hzにまとめ、変化した範囲だけ描き直す
+        self._paint_pending = False
+        self._painted_rect = None  # 前回描いた選択矩形（線幅分を含む）
+
+        # スケール済みpixmapのキャッシュキー（サイズ・元画像・補間方法）
+        self._scaled_key = None
+
+        # リサイズ中は高速な補間で表示し、止まったら滑らかな補間で描き直す
+        self._resizing = False
+        self._smooth_timer = QtCore.QTimer(self)
+        self._smooth_timer.setSingleShot(True)
+        self._smooth_timer.setInterval(150)
+        self._smooth_timer.timeout.connect(self._finish_resize)
 
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -53,9 +190,10 @@ class VideoWidget(QtWidgets.QLabel):
             if os.path.isfile(path):
                 self.fileDropped.emit(path)
 
-    def set_video_frame(self, frame_pixmap):
-        """動画フレームを設定"""
+    def set_video_frame(self, frame_pixmap, source_size):
+        """動画フレームを設定（source_size は元動画の解像度）"""
         self.original_pixmap = frame_pixmap
+        self.source_size = source_size
         self.update_display()
 
     def update_display(self):
@@ -63,13 +201,25 @@ class VideoWidget(QtWidgets.QLabel):
         if self.original_pixmap is None:
             return
 
-        # ウィジェットサイズに合わせてスケール
         widget_size = self.size()
+        if self._resizing:
+            transform = QtCore.Qt.FastTransformation
+        else:
+            transform = QtCore.Qt.SmoothTransformation
+
+        # 前回と同じ条件ならスケールし直さない
+        key = (widget_size.width(), widget_size.height(),
+               self.original_pixmap.cacheKey(), transform)
+        if key == self._scaled_key:
+            return
+        self._scaled_key = key
+
+        # ウィジェットサイズに合わせてスケール
         scaled_pixmap = self.original_pixmap.scaled(
             widget_size.width() - 20,  # マージン
             widget_size.height() - 20,
             QtCore.Qt.KeepAspectRatio,
-            QtCore.Qt.SmoothTransformation
+            transform
         )
 
         self.displayed_pixmap = scaled_pixmap
@@ -87,11 +237,24 @@ class VideoWidget(QtWidgets.QLabel):
         
         self.video_display_rect = QtCore.QRect(offset_x, offset_y, pixmap_w, pixmap_h)
 
+        # 倍率は表示サイズが変わったときだけ計算し直す
+        src_w, src_h = self.source_size
+        self.scale = (src_w / pixmap_w, src_h / pixmap_h)
+        self.selectionChanged.emit()
+
     def resizeEvent(self, event):
         """ウィンドウリサイズ時の処理"""
         super().resizeEvent(event)
         if self.original_pixmap:
+            self._resizing = True
             self.update_display()
+            self._smooth_timer.start()
+
+    def _finish_resize(self):
+        """リサイズが止まったら滑らかな補間で描き直す"""
+        self._resizing = False
+        self.update_display()
+        self.resizeFinished.emit()
 
     def get_video_display_rect(self):
         """動画表示矩形を取得"""
@@ -104,12 +267,34 @@ class VideoWidget(QtWidgets.QLabel):
             self.start_pos = event.pos()
             self.end_pos = self.start_pos
             self.update()
+            self._painted_rect = self._selection_paint_rect()
+            self.selectionChanged.emit()
 
     def mouseMoveEvent(self, event):
         """マウスドラッグ中"""
         if self.dragging:
             self.end_pos = event.pos()
-            self.update()
+            if not self._paint_pending:
+                self._paint_pending = True
+                QtCore.QTimer.singleShot(16, self._do_update)
+
+    def _do_update(self):
+        """溜まったマウス移動をまとめて1回だけ再描画する"""
+        self._paint_pending = False
+        if not (self.start_pos and self.end_pos):
+            return
+        rect = self._selection_paint_rect()
+        # 前回の矩形を消す範囲と今回の矩形を描く範囲だけ更新する
+        if self._painted_rect is not None:
+            self.update(rect.united(self._painted_rect))
+        else:
+            self.update(rect)
+        self._painted_rect = rect
+        self.selectionChanged.emit()
+
+    def _selection_paint_rect(self):
+        """選択矩形の描画範囲（線幅のぶん広げる）"""
+        return QtCore.QRect(self.start_pos, self.end_pos).normalized().adjusted(-3, -3, 3, 3)
 
     def mouseReleaseEvent(self, event):
         """マウスクリック終了"""
@@ -117,6 +302,7 @@ class VideoWidget(QtWidgets.QLabel):
             self.end_pos = event.pos()
             self.dragging = False
             self.update()
+            self.selectionChanged.emit()
 
     def paintEvent(self, event):
         super().paintEvent(event)
@@ -167,7 +353,7 @@ class VideoWidget(QtWidgets.QLabel):
 
     def get_selection_info(self):
         """選択範囲の情報を取得"""
-        if not (self.start_pos and self.end_pos and self.video_display_rect and self.displayed_pixmap):
+        if not (self.start_pos and self.end_pos and self.video_display_rect and self.scale):
             return None
         
         # 選択矩形
@@ -192,7 +378,6 @@ class VideoWidget(QtWidgets.QLabel):
             'selection_rect': selection_rect,
             'video_intersect': video_intersect,
             'relative_pos': (rel_x, rel_y, rel_w, rel_h),
-            'display_size': (self.displayed_pixmap.width(), self.displayed_pixmap.height())
         }
 
     def clear_selection(self):
@@ -200,6 +385,407 @@ class VideoWidget(QtWidgets.QLabel):
         self.start_pos = None
         self.end_pos = None
         self.update()
+        self.selectionChanged.emit()
+
+
+class Cv2Decoder:
+    """OpenCV の VideoCapture でデコードする"""
+
+    def __init__(self, path, cap=None):
+        import cv2
+        # 開き直しは遅いことがあるので、プレビュー用の VideoCapture を巻き戻して使う
+        self.cap = cap
+        if cap is not None:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.own_cap = cap is None or cap.get(cv2.CAP_PROP_POS_FRAMES) != 0
+        if self.own_cap:
+            # 巻き戻せないバックエンドのときだけ開き直す
+            self.cap = cv2.VideoCapture(path)
+            _minimize_buffer(self.cap)
+        if not self.cap.isOpened():
+            self.close()
+            raise RuntimeError("Failed to open video for cropping")
+
+    def frames(self):
+        """BGR のフレームを順に返す"""
+        import cv2
+        cv2.setNumThreads(1)
+        while True:
+            ret, frame = self.cap.read()
+            if not ret:
+                return
+            yield frame
+
+    def close(self):
+        import cv2
+        if self.own_cap:
+            self.cap.release()
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+
+class PyAVDecoder:
+    """PyAV でデコードする（CUDA が使えればハードウェアデコード）"""
+
+    def __init__(self, path, cap=None):
+        import av
+        try:
+            from av.codec.hwaccel import HWAccel
+        except ImportError:  # PyAV 14 未満
+            HWAccel = None
+
+        self.container = None
+        if HWAccel is not None:
+            try:
+                self.container = av.open(path, hwaccel=HWAccel(device_type="cuda"))
+            except av.FFmpegError:
+                pass  # CUDA デバイスが無い
+        if self.container is None:
+            self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+
+    def frames(self):
+        """BGR のフレームを順に返す"""
+        for packet in self.container.demux(self.stream):
+            for frame in packet.decode():
+                yield frame.to_ndarray(format="bgr24")
+
+    def close(self):
+        self.container.close()
+
+
+class DecordDecoder:
+    """decord でデコードする"""
+
+    def __init__(self, path, cap=None):
+        from decord import VideoReader, cpu
+        self.reader = VideoReader(path, ctx=cpu(0))
+
+    def frames(self):
+        """BGR のフレームを順に返す"""
+        while True:
+            try:
+                frame = self.reader.next()
+            except StopIteration:
+                return
+            # decord は RGB なので、チャンネルを逆順に見るビューを返す（コピーはクロップ後の1回だけ）
+            yield frame.asnumpy()[..., ::-1]
+
+    def close(self):
+        self.reader = None
+
+
+@functools.lru_cache(maxsize=None)
+def _select_decoder():
+    """import できるデコーダのクラスを返す（PyAV → decord → OpenCV の順）"""
+    for module_name, decoder_cls in (("av", PyAVDecoder), ("decord", DecordDecoder)):
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            continue
+        return decoder_cls
+    return Cv2Decoder
+
+
+def _stream_rotation(path, cap=None):
+    """回転メタデータの角度を返す（OpenCV が対応していなければ 0）"""
+    import cv2
+    prop = getattr(cv2, "CAP_PROP_ORIENTATION_META", None)
+    if prop is None:
+        return 0
+    own_cap = cap is None
+    if own_cap:
+        cap = cv2.VideoCapture(path)
+    try:
+        return int(cap.get(prop)) % 360
+    finally:
+        if own_cap:
+            cap.release()
+
+
+class CropWorker(QtCore.QObject):
+    """クロップ処理をワーカースレッド (QThread) で実行する"""
+    progress = QtCore.pyqtSignal(int)  # 進捗 (%)
+    finished = QtCore.pyqtSignal(str)  # 保存先パス
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self, video_path, output_path, rect, fps, frame_count,
+                 cap=None):
+        super().__init__()
+        self.video_path = video_path
+        self.cap = cap  # プレビュー用に開いている VideoCapture（Cv2Decoder で使い回す）
+        self.output_path = output_path
+        self.x, self.y, self.width, self.height = rect
+        self.fps = fps
+        self.frame_count = frame_count
+        self._stop = threading.Event()
+        self._last_progress = -1
+
+    def cancel(self):
+        """処理の中断を要求（どのスレッドから呼んでもよい）"""
+        self._stop.set()
+
+    def report(self, done_frames):
+        # 同じ値を何度も UI スレッドへ送らない
+        if self.frame_count <= 0:
+            return
+        percent = int(done_frames * 100 / self.frame_count)
+        if percent != self._last_progress:
+            self._last_progress = percent
+            self.progress.emit(percent)
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        try:
+            if shutil.which("ffmpeg"):
+                duration = self.frame_count / self.fps if self.fps > 0 else 0
+                # 長い動画は分割して並列に。ハードウェアエンコーダは同時セッション数が限られるので分割しない
+                if (duration >= PARALLEL_MIN_DURATION and (os.cpu_count() or 1) >= 4
+                        and _detect_hwenc() is None):
+                    self.crop_parallel()
+                else:
+                    self.crop_ffmpeg()
+            elif _has_cuda_backend() and not _stream_rotation(self.video_path, self.cap):
+                # ffmpeg が無くても NVIDIA GPU があれば GPU 上で処理する
+                # （PyNvVideoCodec は回転メタデータを適用しないので、回転付きの動画は OpenCV で処理する）
+                self.crop_cuda()
+            else:
+                # ffmpeg が無い環境では OpenCV でデコード・エンコードする
+                self.crop_frames()
+        except Exception as e:
+            self.error.emit(str(e))
+            return
+        if not self._stop.is_set():
+            self.finished.emit(self.output_path)
+
+    def crop_ffmpeg(self):
+        """ffmpeg の crop フィルタでクロップ（フレームを Python に通さない）"""
+        pre_args, filters, codec_args = _encoder_args(_detect_hwenc())
+        cmd = [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-nostats", "-progress", "pipe:1", *pre_args,
+            "-i", self.video_path,
+            "-vf", ",".join([f"crop={self.width}:{self.height}:{self.x}:{self.y}", *filters]),
+            *codec_args, "-c:a", "copy", self.output_path,
+        ]
+        _run_ffmpeg(cmd, self._stop, self.report)
+
+    def crop_parallel(self, n=None):
+        """長い動画を時間で n 分割して ffmpeg を並列に走らせ、最後に連結する"""
+        n = n or max(2, (os.cpu_count() or 2) // 2)
+
+        # 区切りはフレームとフレームの中間の時刻に置く。秒に丸めても境界のフレームは片方の区間にだけ入る
+        # 最後の区間は終わりを指定しない（frame_count は見積もりのことがあるので、末尾を切らない）
+        duration = self.frame_count / self.fps
+        bounds = [0.0]
+        for i in range(1, n):
+            frame_idx = max(1, round(duration * i / n * self.fps))
+            bounds.append((frame_idx - 0.5) / self.fps)
+        bounds.append(None)
+        _, _, codec_args = _encoder_args(None)
+        threads_per_part = str(max(1, (os.cpu_count() or n) // n))
+
+        done_frames = [0] * n
+        lock = threading.Lock()
+
+        def encode_part(i, work_dir):
+            start, end = bounds[i], bounds[i + 1]
+            part_path = os.path.join(work_dir, f"part_{i:03d}.mp4")
+            cmd = [
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                "-nostats", "-progress", "pipe:1",
+                "-ss", f"{start:.6f}", *(["-to", f"{end:.6f}"] if end is not None else []),
+                "-i", self.video_path,
+                "-vf", f"crop={self.width}:{self.height}:{self.x}:{self.y}",
+                *codec_args, "-threads", threads_per_part, "-an", part_path,
+            ]
+
+            def on_frame(frame_idx):
+                with lock:
+                    done_frames[i] = frame_idx
+                    self.report(sum(done_frames))
+
+            _run_ffmpeg(cmd, self._stop, on_frame)
+            return os.path.basename(part_path)
+
+        work_dir = tempfile.mkdtemp(prefix="mp4clip_")
+        try:
+            with ThreadPoolExecutor(max_workers=n) as pool:
+                futures = [pool.submit(encode_part, i, work_dir) for i in range(n)]
+                try:
+                    parts = [f.result() for f in futures]
+                except Exception:
+                    self._stop.set()  # 1つ失敗したら残りも止める
+                    raise
+            if self._stop.is_set():
+                return
+
+            # 映像はそのまま連結し、音声は元ファイルからコピーする
+            list_path = os.path.join(work_dir, "list.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                f.writelines(f"file '{part}'\n" for part in parts)
+            _run_ffmpeg([
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                "-nostats", "-progress", "pipe:1",
+                "-f", "concat", "-safe", "0", "-i", list_path, "-i", self.video_path,
+                "-map", "0:v", "-map", "1:a?", "-c", "copy", "-shortest", self.output_path,
+            ], self._stop)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def crop_cuda(self):
+        """GPU 上でクロップ（PyNvVideoCodec でデコード → GpuMat の ROI → cudacodec でエンコード）
+
+        フレームは GPU メモリから出ない。音声は出力されない。
+        """
+        import cv2
+        import PyNvVideoCodec as nvc
+        import torch
+
+        demuxer = nvc.CreateDemuxer(filename=self.video_path)
+        decoder = nvc.CreateDecoder(
+            gpuid=0, codec=demuxer.GetNvCodecId(), cudacontext=0, cudastream=0,
+            usedevicememory=True, outputColorType=nvc.OutputColorType.RGB
+        )
+        writer = cv2.cudacodec.createVideoWriter(
+            self.output_path, (self.width, self.height), cv2.cudacodec.H264, self.fps,
+            cv2.cudacodec.ColorFormat_RGB
+        )
+        roi = (self.x, self.y, self.width, self.height)
+        frame_idx = 0
+        try:
+            for packet in demuxer:
+                for decoded in decoder.Decode(packet):
+                    if self._stop.is_set():
+                        return
+                    # デコード結果 (H,W,3) をコピーせず GpuMat として見て、ROI を切り出す
+                    tensor = torch.from_dlpack(decoded)
+                    h, w = tensor.shape[:2]
+                    if h < self.y + self.height or w < self.x + self.width:
+                        raise RuntimeError("Decoded frame is smaller than the crop area")
+                    gpu_frame = cv2.cuda.createGpuMatFromCudaMemory(
+                        h, w, cv2.CV_8UC3, tensor.data_ptr(), tensor.stride(0)
+                    )
+                    writer.write(cv2.cuda_GpuMat(gpu_frame, roi))
+
+                    frame_idx += 1
+                    self.report(frame_idx)
+        finally:
+            writer.release()
+
+    def crop_frames(self):
+        """Python 側でクロップ（読み込み→クロップ→書き込みを別スレッドで並行実行）"""
+        import cv2
+        import numpy as np
+        x, y, width, height = self.x, self.y, self.width, self.height
+        # 各スレッドの setNumThreads(1) はプロセス全体に効くので、終わったらプレビュー用に元へ戻す
+        prev_threads = cv2.getNumThreads()
+
+        # PyAV / decord は回転メタデータを適用しないので、回転付きの動画は OpenCV で読む
+        decoder_cls = _select_decoder()
+        if decoder_cls is not Cv2Decoder and _stream_rotation(self.video_path, self.cap):
+            decoder_cls = Cv2Decoder
+        decoder = decoder_cls(self.video_path, self.cap)
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out_writer = cv2.VideoWriter(self.output_path, fourcc, self.fps, (width, height))
+
+        if not out_writer.isOpened():
+            decoder.close()
+            raise RuntimeError("Failed to open output video")
+
+        read_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        write_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop = self._stop
+        errors = []
+
+        def put(q, item):
+            # 停止要求が出たら満杯のキューで待ち続けない
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return None
+
+        def fail(e):
+            errors.append(e)
+            stop.set()
+
+        def reader():
+            try:
+                for frame in decoder.frames():
+                    if not put(read_q, frame):
+                        return
+            except Exception as e:
+                fail(e)
+            finally:
+                put(read_q, None)
+
+        # OpenCL が使えれば ROI を UMat (T-API) のまま VideoWriter に渡す
+        use_umat = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
+
+        def cropper():
+            cv2.setNumThreads(1)
+            try:
+                while True:
+                    frame = get(read_q)
+                    if frame is None:
+                        break
+                    # VideoWriter はサイズ違いのフレームを黙って捨てるので、ここで止める
+                    if frame.shape[0] < y + height or frame.shape[1] < x + width:
+                        raise RuntimeError("Decoded frame is smaller than the crop area")
+                    # フレームをクロップ（スライスは非連続なビューなので、ここで1回だけ連続化する）
+                    if use_umat and frame.flags.c_contiguous:
+                        cropped_frame = cv2.UMat(cv2.UMat(frame), [y, y+height], [x, x+width])
+                    else:
+                        cropped_frame = np.ascontiguousarray(frame[y:y+height, x:x+width])
+                    if not put(write_q, cropped_frame):
+                        return
+            except Exception as e:
+                fail(e)
+            finally:
+                put(write_q, None)
+
+        reader_thread = threading.Thread(target=reader, daemon=True)
+        cropper_thread = threading.Thread(target=cropper, daemon=True)
+        reader_thread.start()
+        cropper_thread.start()
+
+        # 書き込みはこのワーカースレッドで行う
+        cv2.setNumThreads(1)
+        frame_idx = 0
+        try:
+            while True:
+                cropped_frame = get(write_q)
+                if cropped_frame is None:
+                    break
+                out_writer.write(cropped_frame)
+
+                frame_idx += 1
+                self.report(frame_idx)
+        except Exception:
+            stop.set()  # 書き込みに失敗したら上流も止める
+            raise
+        finally:
+            # 上流のスレッドが止まってから解放する
+            reader_thread.join()
+            cropper_thread.join()
+            decoder.close()
+            out_writer.release()
+            cv2.setNumThreads(prev_threads)
+
+        if errors:
+            raise errors[0]
 
 
 class MainWindow(QtWidgets.QWidget):
@@ -214,12 +800,27 @@ class MainWindow(QtWidgets.QWidget):
         self.orig_w = 0
         self.orig_h = 0
         self.current_frame = None
+        self._qimg_buf = None  # 表示中の QImage が参照している配列
+        self._rgb_buf = None   # Format_BGR888 が無い Qt 用の RGB 変換先
+
+        # クロップ処理のワーカーとスレッド
+        self.crop_worker = None
+        self.crop_thread = None
+        self.crop_size = None
 
         self.setup_ui()
 
     def setup_ui(self):
         self.video_widget = VideoWidget()
         self.video_widget.fileDropped.connect(self.load_video)
+        self.video_widget.selectionChanged.connect(self.update_selection_info)
+        self.video_widget.resizeFinished.connect(self.on_video_widget_resized)
+
+        # フレーム位置スライダー（離したときだけシークする）
+        self.frame_slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+        self.frame_slider.setTracking(False)
+        self.frame_slider.setEnabled(False)
+        self.frame_slider.valueChanged.connect(self.seek_frame)
 
         # ボタンレイアウト
         button_layout = QtWidgets.QHBoxLayout()
@@ -261,16 +862,12 @@ class MainWindow(QtWidgets.QWidget):
         # メインレイアウト
         main_layout = QtWidgets.QVBoxLayout(self)
         main_layout.addWidget(self.video_widget, stretch=1)
+        main_layout.addWidget(self.frame_slider)
         main_layout.addLayout(button_layout)
         main_layout.addWidget(self.info_label)
         main_layout.addWidget(self.selection_info_label)
         main_layout.addWidget(self.help_label)
 
-        # タイマーで選択情報を更新
-        self.update_timer = QtCore.QTimer()
-        self.update_timer.timeout.connect(self.update_selection_info)
-        self.update_timer.start(100)  # 100ms間隔
-
     def update_selection_info(self):
         """選択情報を更新"""
         if not self.video_widget.start_pos or not self.video_widget.end_pos:
@@ -280,45 +877,64 @@ class MainWindow(QtWidgets.QWidget):
         sel_info = self.video_widget.get_selection_info()
         if sel_info:
             rel_x, rel_y, rel_w, rel_h = sel_info['relative_pos']
-            disp_w, disp_h = sel_info['display_size']
             
             # 元動画サイズでの座標計算
-            if disp_w > 0 and disp_h > 0:
-                scale_x = self.orig_w / disp_w
-                scale_y = self.orig_h / disp_h
-                
-                orig_x = int(rel_x * scale_x)
-                orig_y = int(rel_y * scale_y)
-                orig_w = int(rel_w * scale_x)
-                orig_h = int(rel_h * scale_y)
-                
-                self.selection_info_label.setText(
-                    f"Selection: {orig_w}x{orig_h} at ({orig_x},{orig_y}) in original {self.orig_w}x{self.orig_h}"
-                )
+            scale_x, scale_y = self.video_widget.scale
+            orig_x = int(rel_x * scale_x)
+            orig_y = int(rel_y * scale_y)
+            orig_w = int(rel_w * scale_x)
+            orig_h = int(rel_h * scale_y)
+            
+            self.selection_info_label.setText(
+                f"Selection: {orig_w}x{orig_h} at ({orig_x},{orig_y}) in original {self.orig_w}x{self.orig_h}"
+            )
         else:
             self.selection_info_label.setText("Selection outside video area or too small")
 
     def load_video(self, path):
+        import cv2
+        if self.crop_thread is not None and self.crop_thread.isRunning():
+            # 保存中は VideoCapture をワーカーが使っている
+            QtWidgets.QMessageBox.warning(self, "Busy", "Please wait until saving finishes.")
+            return
+        self.video_widget.scale = None
         try:
             if self.cap:
                 self.cap.release()
-            
-            self.cap = cv2.VideoCapture(path)
-            
-            if not self.cap.isOpened():
-                raise Exception("Failed to open video file")
-            
-            # 動画情報取得
-            self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-            self.orig_w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            self.orig_h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            
+                self.cap = None
+
+            # ffprobe / ffmpeg があればヘッダと先頭1枚だけ読む（VideoCapture はシーク時まで開かない）
+            frame = None
+            if shutil.which("ffprobe") and shutil.which("ffmpeg"):
+                try:
+                    self._probe_header(path)
+                    frame = self._grab_first_frame(path)
+                except (OSError, ValueError, KeyError, subprocess.CalledProcessError):
+                    frame = None
+
+            if frame is None:
+                cap = self._ensure_capture(path)
+
+                # 動画情報取得
+                self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                self.fps = cap.get(cv2.CAP_PROP_FPS)
+                self.orig_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                self.orig_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+                cap.grab()
+                ret, frame = cap.retrieve()
+                if not ret:
+                    frame = None
+
             # 最初のフレームを表示
-            ret, frame = self.cap.read()
-            if ret:
+            if frame is not None:
                 self.current_frame = frame
                 self.show_frame(frame)
+
+            self.frame_slider.blockSignals(True)
+            self.frame_slider.setRange(0, max(0, self.frame_count - 1))
+            self.frame_slider.setValue(0)
+            self.frame_slider.blockSignals(False)
             
             self.video_path = path
             duration = self.frame_count / self.fps if self.fps > 0 else 0
@@ -330,31 +946,144 @@ class MainWindow(QtWidgets.QWidget):
             
             self.clear_btn.setEnabled(True)
             self.crop_btn.setEnabled(True)
+            self.frame_slider.setEnabled(True)
             
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "Error", f"Failed to open video:\n{e}")
             if self.cap:
                 self.cap.release()
                 self.cap = None
+            self.video_path = None
+
+    def _probe_header(self, path):
+        """ffprobe でヘッダだけ読み、サイズ・FPS・フレーム数を設定する"""
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "v:0",
+             "-print_format", "json", "-show_streams", "-show_format", path],
+            capture_output=True, text=True, check=True
+        )
+        info = json.loads(result.stdout)
+        stream = info["streams"][0]
+
+        width, height = int(stream["width"]), int(stream["height"])
+        # 回転メタデータ付きの動画は ffmpeg / OpenCV とも回転後のサイズで出てくる
+        rotation = stream.get("tags", {}).get("rotate", 0)
+        for side_data in stream.get("side_data_list", []):
+            rotation = side_data.get("rotation", rotation)
+        if int(float(rotation)) % 180:
+            width, height = height, width
+
+        # "30000/1001" 形式。avg が無効 ("0/0") なら r_frame_rate を使う
+        fps = 0.0
+        for key in ("avg_frame_rate", "r_frame_rate"):
+            num, _, den = stream.get(key, "0/0").partition("/")
+            if float(den or 1) > 0 and float(num) > 0:
+                fps = float(num) / float(den or 1)
+                break
+
+        if str(stream.get("nb_frames", "")).isdigit():
+            frame_count = int(stream["nb_frames"])
+        else:
+            # MKV / WebM はストリームに長さが無いことが多いので、コンテナの長さから見積もる
+            duration = stream.get("duration") or info.get("format", {}).get("duration", 0)
+            frame_count = int(float(duration) * fps)
+
+        self.orig_w, self.orig_h = width, height
+        self.fps = fps
+        self.frame_count = frame_count
+
+    def _grab_first_frame(self, path):
+        """ffmpeg で先頭フレームを1枚だけ BGR でデコードする"""
+        import numpy as np
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-ss", "0", "-i", path,
+             "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "bgr24", "pipe:1"],
+            capture_output=True, check=True
+        )
+        size = self.orig_w * self.orig_h * 3
+        if size == 0 or len(result.stdout) < size:
+            raise ValueError("Failed to decode the first frame")
+        return np.frombuffer(result.stdout[:size], np.uint8).reshape(self.orig_h, self.orig_w, 3)
+
+    def _ensure_capture(self, path=None):
+        """VideoCapture を必要になった時点で開く"""
+        import cv2
+        if self.cap is None:
+            cap = cv2.VideoCapture(path or self.video_path)
+            if not cap.isOpened():
+                raise Exception("Failed to open video file")
+            _minimize_buffer(cap)
+            self.cap = cap
+        return self.cap
+
+    def seek_frame(self, index):
+        """指定フレームへシークして表示"""
+        import cv2
+        if not self.video_path:
+            return
+        try:
+            cap = self._ensure_capture()
+        except Exception as e:
+            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to open video:\n{e}")
+            return
+        # デコードは表示する1枚だけ（grab で進めて retrieve で取り出す）
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        if not cap.grab():
+            return
+        ret, frame = cap.retrieve()
+        if ret:
+            self.current_frame = frame
+            self.show_frame(frame)
 
     def show_frame(self, frame):
-        """フレームを表示"""
-        # BGR -> RGB変換
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb_frame.shape
-        bytes_per_line = ch * w
-        
-        qt_image = QtGui.QImage(rgb_frame.data, w, h, bytes_per_line, QtGui.QImage.Format_RGB888)
+        """フレームを表示（表示サイズまで縮小してから QImage にする）"""
+        import cv2
+        import numpy as np
+        h, w, ch = frame.shape
+
+        # 表示より大きい解像度は持たない（クロップ座標は self.orig_w/orig_h から計算する）
+        target = self.video_widget.size()
+        scale = min(target.width() / w, target.height() / h, 1.0)
+        if scale < 1.0:
+            w = max(1, int(w * scale))
+            h = max(1, int(h * scale))
+            frame = cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA)
+
+        if HAS_BGR888:
+            # BGR のまま渡す（変換コピー不要）
+            buf = frame
+            image_format = QtGui.QImage.Format_BGR888
+        else:
+            # 古い Qt のみ: 使い回しのバッファに B と R を入れ替えて書き込む
+            if self._rgb_buf is None or self._rgb_buf.shape != frame.shape:
+                self._rgb_buf = np.empty_like(frame)
+            cv2.mixChannels([frame], [self._rgb_buf], [0, 2, 1, 1, 2, 0])
+            buf = self._rgb_buf
+            image_format = QtGui.QImage.Format_RGB888
+
+        # QImage は NumPy のメモリを参照するだけなので、配列を保持しておく
+        self._qimg_buf = buf
+        qt_image = QtGui.QImage(buf.data, w, h, buf.strides[0], image_format)
         original_pixmap = QtGui.QPixmap.fromImage(qt_image)
         
-        self.video_widget.set_video_frame(original_pixmap)
+        self.video_widget.set_video_frame(original_pixmap, (self.orig_w, self.orig_h))
+
+    def on_video_widget_resized(self):
+        """表示領域がプレビューより大きくなったら、元フレームから縮小し直す"""
+        pixmap = self.video_widget.original_pixmap
+        if self.current_frame is None or pixmap is None:
+            return
+        size = self.video_widget.size()
+        scale = min(size.width() / self.orig_w, size.height() / self.orig_h, 1.0)
+        if int(self.orig_w * scale) > pixmap.width():
+            self.show_frame(self.current_frame)
 
     def clear_selection(self):
         """選択をクリア"""
         self.video_widget.clear_selection()
 
     def crop_and_save(self):
-        if not self.cap:
+        if not self.video_path:
             QtWidgets.QMessageBox.warning(self, "No Video", "No video loaded.")
             return
         
@@ -367,19 +1096,18 @@ class MainWindow(QtWidgets.QWidget):
             return
 
         rel_x, rel_y, rel_w, rel_h = sel_info['relative_pos']
-        disp_w, disp_h = sel_info['display_size']
 
         # 元動画サイズでの座標計算
-        scale_x = self.orig_w / disp_w
-        scale_y = self.orig_h / disp_h
+        scale_x, scale_y = self.video_widget.scale
         
         x0 = max(0, int(rel_x * scale_x))
         y0 = max(0, int(rel_y * scale_y))
         x2 = min(self.orig_w, int((rel_x + rel_w) * scale_x))
         y2 = min(self.orig_h, int((rel_y + rel_h) * scale_y))
         
-        crop_w = x2 - x0
-        crop_h = y2 - y0
+        # H.264 (yuv420p) は幅・高さが偶数である必要がある
+        crop_w = (x2 - x0) // 2 * 2
+        crop_h = (y2 - y0) // 2 * 2
 
         if crop_w <= 0 or crop_h <= 0:
             QtWidgets.QMessageBox.warning(self, "Invalid Selection", "Invalid crop dimensions.")
@@ -399,47 +1127,54 @@ class MainWindow(QtWidgets.QWidget):
         self.process_crop(out_path, x0, y0, crop_w, crop_h)
 
     def process_crop(self, output_path, x, y, width, height):
-        """動画をクロップして保存"""
-        try:
-            self.info_label.setText(f"Cropping to {width}x{height} at ({x},{y})...")
-            QtWidgets.QApplication.processEvents()
-            
-            input_cap = cv2.VideoCapture(self.video_path)
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out_writer = cv2.VideoWriter(output_path, fourcc, self.fps, (width, height))
-            
-            frame_idx = 0
-            
-            while True:
-                ret, frame = input_cap.read()
-                if not ret:
-                    break
-                
-                # フレームをクロップ
-                cropped_frame = frame[y:y+height, x:x+width]
-                out_writer.write(cropped_frame)
-                
-                # 進捗表示
-                frame_idx += 1
-                if frame_idx % 30 == 0:
-                    progress = (frame_idx / self.frame_count) * 100
-                    self.info_label.setText(f"Processing... {progress:.1f}%")
-                    QtWidgets.QApplication.processEvents()
-            
-            input_cap.release()
-            out_writer.release()
-            
-            self.info_label.setText(f"Saved: {os.path.basename(output_path)}")
-            QtWidgets.QMessageBox.information(
-                self, "Complete", 
-                f"Cropped video saved!\nFile: {os.path.basename(output_path)}\nSize: {width}x{height}"
-            )
-            
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "Error", f"Failed to crop video:\n{e}")
-            self.info_label.setText("Error occurred during cropping")
+        """動画をクロップして保存（処理はワーカースレッドで行う）"""
+        self.info_label.setText(f"Cropping to {width}x{height} at ({x},{y})...")
+        self.crop_btn.setEnabled(False)
+        self.frame_slider.setEnabled(False)  # 保存中は VideoCapture をワーカーに渡す（未オープンなら OpenCV 経路で開く）
+        self.crop_size = (width, height)
+
+        self.crop_worker = CropWorker(
+            self.video_path, output_path, (x, y, width, height),
+            self.fps, self.frame_count, self.cap
+        )
+        self.crop_thread = QtCore.QThread(self)
+        self.crop_worker.moveToThread(self.crop_thread)
+
+        self.crop_thread.started.connect(self.crop_worker.run)
+        self.crop_worker.progress.connect(self.on_crop_progress)
+        self.crop_worker.finished.connect(self.on_crop_finished)
+        self.crop_worker.error.connect(self.on_crop_failed)
+        self.crop_worker.finished.connect(self.crop_thread.quit)
+        self.crop_worker.error.connect(self.crop_thread.quit)
+        self.crop_thread.finished.connect(self.crop_worker.deleteLater)
+
+        self.crop_thread.start()
+
+    def on_crop_progress(self, percent):
+        self.info_label.setText(f"Processing... {percent}%")
+
+    def on_crop_finished(self, output_path):
+        width, height = self.crop_size
+        self.crop_btn.setEnabled(True)
+        self.frame_slider.setEnabled(True)
+        self.info_label.setText(f"Saved: {os.path.basename(output_path)}")
+        QtWidgets.QMessageBox.information(
+            self, "Complete", 
+            f"Cropped video saved!\nFile: {os.path.basename(output_path)}\nSize: {width}x{height}"
+        )
+
+    def on_crop_failed(self, message):
+        self.crop_btn.setEnabled(True)
+        self.frame_slider.setEnabled(True)
+        QtWidgets.QMessageBox.critical(self, "Error", f"Failed to crop video:\n{message}")
+        self.info_label.setText("Error occurred during cropping")
 
     def closeEvent(self, event):
+        # 処理中のクロップを止めて、書き込み中のファイルを閉じる
+        if self.crop_thread is not None and self.crop_thread.isRunning():
+            self.crop_worker.cancel()
+            self.crop_thread.quit()
+            self.crop_thread.wait()
         if self.cap:
             self.cap.release()
         event.accept()